@@ -20,14 +20,15 @@
 # Authors:
 #   Bram de Jong <bram.dejong at domain.com where domain in gmail>
 
-from PIL import ImageFilter, ImageChops, Image, ImageDraw, ImageColor
-from functools import partial
-from time import time
+from PIL import ImageFilter, ImageChops, Image, ImageColor
+from functools import lru_cache, partial
 import math
 import numpy
+from numpy.lib.stride_tricks import sliding_window_view
 import os
 import re
-import scikits.audiolab as audiolab
+import scipy.fft
+import soundfile
 import subprocess
 import sys
 
@@ -35,8 +36,8 @@ class AudioProcessingException(Exception):
     pass
 
 class TestAudioFile(object):
-    """A class that mimics audiolab.sndfile but generates noise instead of reading
-    a wave file. Additionally it can be told to have a "broken" header and thus crashing
+    """A class with the seek/read_frames interface of a sound file, that generates noise instead
+    of reading a wave file. Additionally it can be told to have a "broken" header and thus crashing
     in the middle of the file. Also useful for testing ultra-short files of 20 samples."""
     def __init__(self, num_frames, has_broken_header=False):
         self.seekpoint = 0
@@ -49,41 +50,38 @@ class TestAudioFile(object):
         self.seekpoint = seekpoint
 
     def read_frames(self, frames_to_read):
-        if self.has_broken_header and self.seekpoint + frames_to_read > self.num_frames / 2:
+        if self.has_broken_header and self.seekpoint + frames_to_read > self.nframes / 2:
             raise RuntimeError()
 
-        num_frames_left = self.num_frames - self.seekpoint
+        num_frames_left = self.nframes - self.seekpoint
         will_read = num_frames_left if num_frames_left < frames_to_read else frames_to_read
         self.seekpoint += will_read
         return numpy.random.random(will_read)*2 - 1 
 
 
+def read_mono(filename):
+    """ read the whole file into a mono float32 array, by selecting the left channel only.
+    Colors end up as 8 bit values, so single precision is plenty and halves the memory
+    traffic of the analysis. Returns (samples, samplerate), samples is a view on the decoded frames """
+    samples, samplerate = soundfile.read(filename, dtype='float32', always_2d=True)
+    
+    return samples[:,0], samplerate
+
 def get_max_level(filename):
-    max_value = 0
-    buffer_size = 4096
-    audio_file = audiolab.Sndfile(filename, 'r')
-    n_samples_left = audio_file.nframes
+    """ return the maximum absolute sample value of the (mono) file. AudioProcessor finds this
+    itself from the samples it already holds, this is for when only the level is needed """
+    samples, samplerate = read_mono(filename)
     
-    while n_samples_left:
-        to_read = min(buffer_size, n_samples_left)
-
-        try:
-            samples = audio_file.read_frames(to_read)
-        except RuntimeError:
-            # this can happen with a broken header
-            break
-
-        # convert to mono by selecting left channel only
-        if audio_file.channels > 1:
-            samples = samples[:,0]
-        
-        max_value = max(max_value, numpy.abs(samples).max())
-        
-        n_samples_left -= to_read
-            
-    audio_file.close()
+    return float(numpy.abs(samples).max()) if len(samples) else 0
+
+@lru_cache(maxsize=16)
+def get_window(window_function, size):
+    """ return window_function(size) as float32, cached so a batch of files doesn't rebuild the same
+    window for every AudioProcessor. The window is shared, so it is made read only """
+    window = numpy.asarray(window_function(size), dtype=numpy.float32)
+    window.setflags(write=False)
     
-    return max_value
+    return window
 
 class AudioProcessor(object):
     """
@@ -91,103 +89,98 @@ class AudioProcessor(object):
     samples in that chunk of audio.
     """
     def __init__(self, input_filename, fft_size, window_function=numpy.hanning):
-        max_level = get_max_level(input_filename)
-        
-        self.audio_file = audiolab.Sndfile(input_filename, 'r')
         self.fft_size = fft_size
-        self.window = window_function(self.fft_size)
-        self.spectrum_range = None
+        
+        # keep the whole (mono) file in memory, so we don't need to seek around in it
+        # nor read it twice to find the maximum level
+        samples, self.samplerate = read_mono(input_filename)
+        
+        # the samples are stored once, with fft_size/2 zeros on either side: the window around
+        # sample i is simply padded_samples[i:i + fft_size], also at the start and end of the
+        # file. self.samples is a view on the middle part
+        start_pad = self.fft_size // 2
+        self.padded_samples = numpy.zeros(len(samples) + self.fft_size, dtype=numpy.float32)
+        self.samples = self.padded_samples[start_pad:start_pad + len(samples)]
+        self.samples[:] = samples
+        max_level = float(numpy.abs(self.samples).max()) if len(self.samples) else 0
+        
+        # zero pad the FFT to a length pocketfft is fast at, fft_size is usually one already
+        self.fft_length = scipy.fft.next_fast_len(fft_size, real=True)
+        self.window = get_window(window_function, self.fft_size)
+        # windowing with a boxcar (e.g. window_function=numpy.ones) doesn't change anything
+        self.rectangular_window = numpy.allclose(self.window, 1.0)
+        # frequency in hertz of every FFT bin, DC offset should not be included
+        bins = self.fft_length // 2
+        self.freq_axis = numpy.arange(bins + 1) * (self.samplerate * 0.5 / bins)
+        self.freq_axis[:2] = 0
+        # a spectrum dotted with these gives its energy and its frequency weighted energy in one
+        # pass, both without the DC offset
+        self.spectrum_weights = numpy.column_stack((self.freq_axis > 0, self.freq_axis)).astype(numpy.float32)
         self.lower = 100
         self.higher = 22050
         self.lower_log = math.log10(self.lower)
         self.higher_log = math.log10(self.higher)
-        self.clip = lambda val, low, high: min(high, max(low, val))
         
         # figure out what the maximum value is for an FFT doing the FFT of a DC signal
-        fft = numpy.fft.rfft(numpy.ones(fft_size) * self.window)
+        fft = scipy.fft.rfft(numpy.ones(fft_size) * self.window, n=self.fft_length)
         max_fft = (numpy.abs(fft)).max()
-        # set the scale to normalized audio and normalized FFT
-        self.scale = 1.0/max_level/max_fft if max_level > 0 else 1
+        # frames are silent if the energy of their normalized (audio and FFT) spectrum is below 1e-60,
+        # the normalization scale is folded into the threshold as it cancels out of the centroid
+        self.silence_threshold = 1e-60 * max_level * max_fft if max_level > 0 else 1e-60
 
     def read(self, start, size, resize_if_less=False):
-        """ read size samples starting at start, if resize_if_less is True and less than size
-        samples are read, resize the array to size and fill with zeros """
+        """ return size samples starting at start, if resize_if_less is True and less than size
+        samples are available, resize the array to size and fill with zeros. Without resizing
+        this is a view on the in-memory samples, so copy it before changing it """
         
-        # number of zeros to add to start and end of the buffer
-        add_to_start = 0
-        add_to_end = 0
+        samples = self.samples[max(start, 0):max(start + size, 0)]
         
-        if start < 0:
+        if resize_if_less and len(samples) < size:
             # the first FFT window starts centered around zero
-            if size + start <= 0:
-                return numpy.zeros(size) if resize_if_less else numpy.array([])
-            else:
-                self.audio_file.seek(0)
-
-                add_to_start = -start # remember: start is negative!
-                to_read = size + start
-
-                if to_read > self.audio_file.nframes:
-                    add_to_end = to_read - self.audio_file.nframes
-                    to_read = self.audio_file.nframes
-        else:
-            self.audio_file.seek(start)
-        
-            to_read = size
-            if start + to_read >= self.audio_file.nframes:
-                to_read = self.audio_file.nframes - start
-                add_to_end = size - to_read
-        
-        try:
-            samples = self.audio_file.read_frames(to_read)
-        except RuntimeError:
-            # this can happen for wave files with broken headers...
-            return numpy.zeros(size) if resize_if_less else numpy.zeros(2)
-
-        # convert to mono by selecting left channel only
-        if self.audio_file.channels > 1:
-            samples = samples[:,0]
-
-        if resize_if_less and (add_to_start > 0 or add_to_end > 0):
-            if add_to_start > 0:
-                samples = numpy.concatenate((numpy.zeros(add_to_start), samples), axis=1)
-            
-            if add_to_end > 0:
-                samples = numpy.resize(samples, size)
-                samples[size - add_to_end:] = 0
+            add_to_start = max(-start, 0)
+            padded = numpy.zeros(size, dtype=samples.dtype)
+            padded[add_to_start:add_to_start + len(samples)] = samples
+            samples = padded
         
         return samples
 
 
-    def spectral_centroid(self, seek_point, spec_range=110.0):
-        """ starting at seek_point read fft_size samples, and calculate the spectral centroid """
-        
-        samples = self.read(seek_point - self.fft_size/2, self.fft_size, True)
+    def spectral_centroid(self, seek_point):
+        """ calculate the spectral centroid of the fft_size samples centered around seek_point """
 
-        samples *= self.window
-        fft = numpy.fft.rfft(samples)
-        spectrum = self.scale * numpy.abs(fft) # normalized abs(FFT) between 0 and 1
-        length = numpy.float64(spectrum.shape[0])
-        spectrum[:2] = 0 # DC offset should not be included
-        
-        energy = spectrum.sum()
-        if energy < 1e-60:
-            spectral_centroid = -1 # Silence
-        else:
-            # calculate the spectral centroid
-            
-            if self.spectrum_range == None:  #Always is?
-                self.spectrum_range = numpy.arange(length)
-        
-            # Compute the spectral centroid in hertz
-            spectral_centroid = (spectrum * self.spectrum_range).sum() / (energy * (length - 1)) * self.audio_file.samplerate * 0.5
-            
-            # Clip centroid to desired frequency range, apply log so it's 
-            # proportional to human perception of frequency, and then scale 
-            # desired frequency range from 0 to 1
-            spectral_centroid = (math.log10(self.clip(spectral_centroid, self.lower, self.higher)) - self.lower_log) / (self.higher_log - self.lower_log)
-        
-        return (spectral_centroid)
+        return self.spectral_centroids(numpy.array([seek_point]))[0]
+
+
+    def spectral_centroids(self, seek_points):
+        """ calculate the spectral centroid around each of the seek_points in one go: the windows
+        of fft_size samples are taken from the in-memory samples and transformed in a single batched
+        FFT. Returns an array with a value between 0 and 1 for each point, -1 for silence. """
+
+        # a (read only) view with every window of fft_size samples in the padded buffer,
+        # window i is centered around sample i
+        windows = sliding_window_view(self.padded_samples, self.fft_size)
+
+        frames = windows[seek_points] # fancy indexing copies, so the frames can be windowed in place
+        if not self.rectangular_window:
+            frames *= self.window
+        fft = scipy.fft.rfft(frames, n=self.fft_length, axis=1, workers=-1, overwrite_x=True)
+        energy, weighted_energy = numpy.dot(numpy.abs(fft), self.spectrum_weights).T
+        # the threshold is far below what float32 can hold, so compare in double precision
+        silence = energy.astype(numpy.float64) < self.silence_threshold
+
+        # Compute the spectral centroids in hertz, silent frames are divided by 1 instead of 0
+        spectral_centroids = self.scale_centroid(weighted_energy / numpy.where(silence, 1, energy))
+        spectral_centroids[silence] = -1 # Silence
+
+        return spectral_centroids
+
+
+    def scale_centroid(self, spectral_centroid):
+        """ Clip centroid to desired frequency range, apply log so it's proportional to human
+        perception of frequency, and then scale desired frequency range from 0 to 1. Works on
+        a single centroid as well as on an array of them """
+
+        return (numpy.log10(numpy.clip(spectral_centroid, self.lower, self.higher)) - self.lower_log) / (self.higher_log - self.lower_log)
 
 
     def peaks(self, start_seek, end_seek):
@@ -195,68 +188,98 @@ class AudioProcessor(object):
         in that range. Returns that pair in the order they were found. So if min was found first,
         it returns (min, max) else the other way around. """
         
-        # larger blocksizes are faster but take more mem...
-        # Aha, Watson, a clue, a tradeof!
-        block_size = 4096
-    
-        max_index = -1
-        max_value = -1
-        min_index = -1
-        min_value = 1
-    
-        if end_seek > self.audio_file.nframes:
-            end_seek = self.audio_file.nframes
-    
-        if block_size > end_seek - start_seek:
-            block_size = end_seek - start_seek
-        
-        for i in range(start_seek, end_seek, block_size):
-            samples = self.read(i, block_size)
-    
-            local_max_index = numpy.argmax(samples)
-            local_max_value = samples[local_max_index]
-    
-            if local_max_value > max_value:
-                max_value = local_max_value
-                max_index = local_max_index
-    
-            local_min_index = numpy.argmin(samples)
-            local_min_value = samples[local_min_index]
-            
-            if local_min_value < min_value:
-                min_value = local_min_value
-                min_index = local_min_index
+        # the whole file is in memory, so this is just a slice
+        samples = self.samples[start_seek:end_seek]
+
+        max_index = numpy.argmax(samples)
+        max_value = samples[max_index]
+
+        min_index = numpy.argmin(samples)
+        min_value = samples[min_index]
     
         return (min_value, max_value) if min_index < max_index else (max_value, min_value)
 
 
+    def all_peaks(self, seek_points, block_size=256):
+        """ find the minimum and maximum peak between every two consecutive seek_points at once.
+        Returns two arrays with one value per range: the peak that was found first and the one
+        that was found last, i.e. the same pairs peaks would return. Empty ranges (more pixels
+        than samples) give the sample at their seek point, an empty file gives all zeros. """
+
+        if not len(self.samples):
+            # an empty file is drawn as flat silence
+            return numpy.zeros((2, len(seek_points) - 1), dtype=self.samples.dtype)
+
+        samples = self.samples[:seek_points[-1]]
+        starts = seek_points[:-1]
+
+        # the ranges are split further into blocks of at most block_size samples, so which peak
+        # came first can be found on arrays of one value per block instead of one per sample
+        bounds = numpy.sort(numpy.concatenate((starts, numpy.arange(0, len(samples), block_size))), kind='stable')
+        bounds = bounds[numpy.diff(bounds, prepend=-1) > 0]
+        block_min = numpy.minimum.reduceat(samples, bounds)
+        block_max = numpy.maximum.reduceat(samples, bounds)
+
+        # the first block of every range, and the peaks of the range from those of its blocks
+        first_block = numpy.searchsorted(bounds, seek_points)
+        num_blocks = numpy.diff(first_block)
+        min_values = numpy.minimum.reduceat(block_min, first_block[:-1])
+        max_values = numpy.maximum.reduceat(block_max, first_block[:-1])
+        empty = num_blocks == 0
+        min_values[empty] = max_values[empty] = samples[starts[empty]]
+
+        # the first block of each range that holds its peak, empty ranges have min == max so
+        # their order doesn't matter
+        min_found = numpy.append(numpy.flatnonzero(block_min == numpy.repeat(min_values, num_blocks)), len(bounds))
+        max_found = numpy.append(numpy.flatnonzero(block_max == numpy.repeat(max_values, num_blocks)), len(bounds))
+        min_block = min_found[numpy.searchsorted(min_found, first_block[:-1])]
+        max_block = max_found[numpy.searchsorted(max_found, first_block[:-1])]
+        min_first = min_block < max_block
+
+        # if both peaks are in the same block, look for the first of them in its samples. Reading
+        # on past the end of the block is harmless, as both peaks are found inside it
+        same = numpy.flatnonzero((min_block == max_block) & ~empty)
+        index = numpy.minimum(bounds[min_block[same], numpy.newaxis] + numpy.arange(block_size), len(samples) - 1)
+        block_samples = samples[index]
+        min_index = numpy.argmax(block_samples == min_values[same, numpy.newaxis], axis=1)
+        max_index = numpy.argmax(block_samples == max_values[same, numpy.newaxis], axis=1)
+        min_first[same] = min_index < max_index
+
+        return numpy.where(min_first, min_values, max_values), numpy.where(min_first, max_values, min_values)
+
+
+    def analyze(self, image_width):
+        """ split the file in image_width ranges and calculate the spectral centroid and the
+        peaks of every range. Returns (spectral_centroids, first_peaks, last_peaks) arrays. """
+
+        samples_per_pixel = len(self.samples) / float(image_width)
+        seek_points = (numpy.arange(image_width + 1) * samples_per_pixel).astype(int)
+
+        # both are batched numpy passes over the whole file, there is no per column python loop
+        spectral_centroids = self.spectral_centroids(seek_points[:-1])
+        first_peaks, last_peaks = self.all_peaks(seek_points)
+
+        return spectral_centroids, first_peaks, last_peaks
+
+
 def interpolate_colors(colors, flat=False, num_colors=256):
     """ given a list of colors, create a larger list of colors linearly interpolating
     the first one. If flatten is True a list of numbers will be returned. If
-    False, a list of (r,g,b) tuples. num_colors is the number of colors wanted
-    in the final list """
+    False, a (num_colors, 3) uint8 array of r,g,b values. num_colors is the number
+    of colors wanted in the final list """
     
-    palette = []
+    colors = numpy.asarray(colors, dtype=numpy.float64)
+    
+    index = numpy.arange(num_colors) * (len(colors) - 1) / (num_colors - 1.0) # same as numpy.linspace(0,len(colors)-1,num_colors)
+    index_int = index.astype(int)
+    alpha = (index - index_int)[:, numpy.newaxis]
+    next_index = numpy.minimum(index_int + 1, len(colors) - 1)
+    
+    palette = ((1.0 - alpha) * colors[index_int] + alpha * colors[next_index]).astype(numpy.uint8)
+    
+    if flat:
+        return palette.reshape(-1).tolist()
     
-    for i in range(num_colors):
-        index = (i * (len(colors) - 1))/(num_colors - 1.0) # same as numpy.linspace(0,len(colors)-1,num_colors)
-        index_int = int(index)
-        alpha = index - float(index_int)
-        
-        if alpha > 0:
-            r = (1.0 - alpha) * colors[index_int][0] + alpha * colors[index_int + 1][0]
-            g = (1.0 - alpha) * colors[index_int][1] + alpha * colors[index_int + 1][1]
-            b = (1.0 - alpha) * colors[index_int][2] + alpha * colors[index_int + 1][2]
-        else:
-            r = (1.0 - alpha) * colors[index_int][0]
-            g = (1.0 - alpha) * colors[index_int][1]
-            b = (1.0 - alpha) * colors[index_int][2]
-        
-        if flat:
-            palette.extend((int(r), int(g), int(b)))
-        else:
-            palette.append((int(r), int(g), int(b)))
-        
     return palette
 
 
@@ -279,7 +302,7 @@ class WaveformImage(object):
     """
     def __init__(self, image_width, image_height, palette=1):
         if image_height % 2 == 0:
-            raise AudioProcessingException, "Height should be an odd number: images look much better this way"
+            raise AudioProcessingException("Height should be an odd number: images look much better this way")
 
         if palette == 1:
             background_color = (0,0,0)
@@ -294,113 +317,119 @@ class WaveformImage(object):
             colors = [self.color_from_value(value/29.0) for value in range(0,30)]
         elif palette == 3:
             background_color = (213, 217, 221)
-            colors = map( partial(desaturate, amount=0.7), [
+            colors = list(map( partial(desaturate, amount=0.7), [
                         (50,0,200),
                         (0,220,80),
                         (255,224,0),
-                     ])
+                     ]))
         elif palette == 4:
              background_color = (213, 217, 221)
-             colors = map( partial(desaturate, amount=0.8), [self.color_from_value(value/29.0) for value in range(0,30)])
+             colors = list(map( partial(desaturate, amount=0.8), [self.color_from_value(value/29.0) for value in range(0,30)]))
             
-        self.image = Image.new("RGB", (image_width, image_height), background_color)
+        # the image is drawn as a (height, width, 3) array and only turned into a PIL image on save
+        self.canvas = numpy.empty((image_height, image_width, 3), dtype=numpy.uint8)
+        self.canvas[:] = background_color
         
         self.image_width = image_width
         self.image_height = image_height
         
-        self.draw = ImageDraw.Draw(self.image)
-        self.previous_x, self.previous_y = None, None
-        
+        # (256, 3) array of r,g,b values, so all line colors can be looked up at once
         self.color_lookup = interpolate_colors(colors)
-        self.pix = self.image.load()
 
     def color_from_value(self, value):
         """ given a value between 0 and 1, return an (r,g,b) tuple """
 
         return ImageColor.getrgb("hsl(%d,%d%%,%d%%)" % (int( (1.0 - value) * 360 ), 80, 50))
         
-    def draw_peaks(self, x, peaks, spectral_centroid):
-        """ draw 2 peaks at x using the spectral_centroid for color """
+    def line_colors(self, spectral_centroids):
+        """ given an array of spectral centroids, return an (n, 3) array with the color
+        of the line for each of them """
+
+        line_colors = self.color_lookup[(numpy.maximum(spectral_centroids, 0)*255.0).astype(int)]
+        # Dark gray for silence
+        line_colors[spectral_centroids == -1] = (50, 50, 50)
+
+        return line_colors
+
+    def draw_peaks(self, peaks, spectral_centroids):
+        """ draw the 2 peaks of every column, using the spectral_centroids for color. peaks is a
+        pair of arrays with the first and the last peak of each column """
 
         y1 = self.image_height * 0.5 - peaks[0] * (self.image_height - 4) * 0.5
         y2 = self.image_height * 0.5 - peaks[1] * (self.image_height - 4) * 0.5
         
-        if spectral_centroid == -1:
-            # Dark gray for silence
-            line_color = (50, 50, 50)
-        else:
-            line_color = self.color_lookup[int(spectral_centroid*255.0)]
+        line_colors = self.line_colors(spectral_centroids)
         
-        if self.previous_y != None:
-            self.draw.line([self.previous_x, self.previous_y, x, y1, x, y2], line_color)
-        else:
-            self.draw.line([x, y1, x, y2], line_color)
-    
-        self.previous_x, self.previous_y = x, y2
+        # PIL draws lines at whole pixel rows
+        row1 = y1.astype(int)
+        row2 = y2.astype(int)
         
-        self.draw_anti_aliased_pixels(x, y1, y2, line_color)
-    
-    def draw_anti_aliased_pixels(self, x, y1, y2, color):
-        """ vertical anti-aliasing at y1 and y2 """
-
-        y_max = max(y1, y2)
-        y_max_int = int(y_max)
-        alpha = y_max - y_max_int
+        # each column is a vertical line from y1 to y2, joined to y2 of the previous column. Like
+        # PIL draws it, the first half of the join (rounded down) is in the previous column, and
+        # the rest in this one
+        step = row1[1:] - row2[:-1]
+        join_end = row2[:-1] + numpy.sign(step) * ((numpy.abs(step) - 1) // 2)
+        join_start = numpy.concatenate((row1[:1], join_end + numpy.sign(step)))
         
-        if alpha > 0.0 and alpha < 1.0 and y_max_int + 1 < self.image_height:
-            current_pix = self.pix[x, y_max_int + 1]
-                
-            r = int((1-alpha)*current_pix[0] + alpha*color[0])
-            g = int((1-alpha)*current_pix[1] + alpha*color[1])
-            b = int((1-alpha)*current_pix[2] + alpha*color[2])
-            
-            self.pix[x, y_max_int + 1] = (r,g,b)
-            
-        y_min = min(y1, y2)
-        y_min_int = int(y_min)
-        alpha = 1.0 - (y_min - y_min_int)
+        top = numpy.minimum(numpy.minimum(row1, row2), join_start)
+        bottom = numpy.maximum(numpy.maximum(row1, row2), join_start)
+        self.draw_vertical_lines(top, bottom, line_colors)
         
-        if alpha > 0.0 and alpha < 1.0 and y_min_int - 1 >= 0:
-            current_pix = self.pix[x, y_min_int - 1]
-                
-            r = int((1-alpha)*current_pix[0] + alpha*color[0])
-            g = int((1-alpha)*current_pix[1] + alpha*color[1])
-            b = int((1-alpha)*current_pix[2] + alpha*color[2])
-            
-            self.pix[x, y_min_int - 1] = (r,g,b)
+        self.draw_anti_aliased_pixels(y1, y2, line_colors)
+        
+        # the join is drawn with the next column, so it covers the previous column in its color
+        top = numpy.minimum(row2[:-1], join_end)
+        bottom = numpy.maximum(row2[:-1], join_end)
+        self.draw_vertical_lines(top, bottom, line_colors[1:], slice(0, -1))
+    
+    def draw_vertical_lines(self, top, bottom, colors, columns=slice(None)):
+        """ in each of the columns, draw a vertical line from row top to row bottom (inclusive)
+        in its own color """
+
+        canvas = self.canvas[:, columns]
+        rows = numpy.arange(self.image_height)[:, numpy.newaxis]
+        line = (top <= rows) & (rows <= bottom)
+        canvas[line] = numpy.broadcast_to(colors, canvas.shape)[line]
+    
+    def draw_anti_aliased_pixels(self, y1, y2, colors):
+        """ vertical anti-aliasing at y1 and y2 of every column at once """
+
+        x = numpy.arange(self.image_width)
+
+        # the pixel below the line gets the fraction of y_max past its row, the pixel above it
+        # what is left of the row of y_min
+        y_max = numpy.maximum(y1, y2)
+        y_max_int = y_max.astype(int)
+        y_min = numpy.minimum(y1, y2)
+        y_min_int = y_min.astype(int)
+        
+        rows = numpy.concatenate((y_max_int + 1, y_min_int - 1))
+        alpha = numpy.concatenate((y_max - y_max_int, 1.0 - (y_min - y_min_int)))
+        
+        # both pixels are always on different rows, so they can be blended in one go
+        blend = (alpha > 0.0) & (alpha < 1.0) & (rows >= 0) & (rows < self.image_height)
+        rows, columns, a = rows[blend], numpy.tile(x, 2)[blend], alpha[blend, numpy.newaxis]
+        colors = numpy.tile(colors, (2, 1))[blend]
+        self.canvas[rows, columns] = ((1-a)*self.canvas[rows, columns] + a*colors).astype(numpy.uint8)
             
     def save(self, filename):
         # draw a zero "zero" line
         a = 25
-        for x in range(self.image_width):
-            self.pix[x, self.image_height/2] = tuple(map(lambda p: p+a, self.pix[x, self.image_height/2]))
+        zero_line = self.canvas[self.image_height // 2]
+        zero_line[:] = numpy.minimum(zero_line.astype(int) + a, 255)
         
-        self.image.save(filename, format = 'png')
+        Image.fromarray(self.canvas).save(filename, format = 'png')
         
 
 def create_wave_images(input_filename, output_filename_w, output_filename_s, image_width, image_height, fft_size, progress_callback=None):
     """
     Utility function for creating both wavefile and spectrum images from an audio input file.
     """
-    start_time = time()
     processor = AudioProcessor(input_filename, fft_size, numpy.hanning)
-    samples_per_pixel = processor.audio_file.nframes / float(image_width)
+    spectral_centroids, first_peaks, last_peaks = processor.analyze(image_width)
     
     waveform = WaveformImage(image_width, image_height)
-    
-    for x in range(image_width):
-        if time() - start_time > 30: # Kludge to crash if it takes longer than 10 seconds
-            raise Exception("Took too long")
-        if progress_callback and x % (image_width/10) == 0:
-            progress_callback((x*100)/image_width)
-
-        seek_point = int(x * samples_per_pixel)
-        next_seek_point = int((x + 1) * samples_per_pixel)
-        
-        spectral_centroid = processor.spectral_centroid(seek_point)
-        peaks = processor.peaks(seek_point, next_seek_point)
-        
-        waveform.draw_peaks(x, peaks, spectral_centroid)
+    waveform.draw_peaks((first_peaks, last_peaks), spectral_centroids)
     
     if progress_callback:
         progress_callback(100)
@@ -1,10 +1,10 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
-from hotshot import stats
 from processing import create_wave_images, AudioProcessingException
-import hotshot
+import cProfile
 import optparse
 import os
+import pstats
 import subprocess
 import sys
 
@@ -46,22 +46,22 @@ for input_file in args:
     
     args = (input_file, output_file_w, output_file_s, options.image_width, options.image_height, options.fft_size, )#progress_callback)
 
-    print "Generating thumbnail for file %s:\n\t" % input_file,
+    print("Generating thumbnail for file %s:\n\t" % input_file, end="")
 
     if not options.profile:
         try:
             create_wave_images(*args)
-        except AudioProcessingException, e:
-            print "Error running wav2png: ", e
+        except AudioProcessingException as e:
+            print("Error running wav2png: ", e)
     else:
-        prof = hotshot.Profile("stats")
+        prof = cProfile.Profile()
         prof.runcall(create_wave_images, *args)
-        prof.close()
+        prof.dump_stats("stats")
         
-        print "\n---------- profiling information ----------\n"
-        s = stats.load("stats")
+        print("\n---------- profiling information ----------\n")
+        s = pstats.Stats("stats")
         s.strip_dirs()
         s.sort_stats("time")
         s.print_stats(30)
     
-    print
+    print()